@@ -3,6 +3,10 @@ import treewalk
 import logging
 from .randomtree import *
 import copy
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 
 logging.basicConfig()
@@ -234,9 +238,226 @@ class PatchTreeTestCase(CompareWithModificationsSetup):
         self.assertEqualPatch(patch2, empty_patch)
 
 
+class CountingMemoryTree(treewalk.MemoryTree):
+    def __init__(self, root, tree_object):
+        super(CountingMemoryTree, self).__init__(root, tree_object)
+        self.call_count = 0
+
+    def is_exist(self, node_ref):
+        self.call_count += 1
+        return super(CountingMemoryTree, self).is_exist(node_ref)
+
+    def get_node_data(self, node_ref):
+        self.call_count += 1
+        return super(CountingMemoryTree, self).get_node_data(node_ref)
+
+    def get_subnodes(self, node_ref, node_data):
+        self.call_count += 1
+        return super(CountingMemoryTree, self).get_subnodes(node_ref, node_data)
+
+
+class FailingMemoryTree(treewalk.MemoryTree):
+    def __init__(self, root, tree_object, failing_ref):
+        super(FailingMemoryTree, self).__init__(root, tree_object)
+        self.failing_ref = failing_ref
+
+    def get_node_data(self, node_ref):
+        if node_ref == self.failing_ref:
+            raise OSError(u'vanished {}'.format(node_ref))
+        return super(FailingMemoryTree, self).get_node_data(node_ref)
+
+
+class CompareMultiTestCase(CompareWithModificationsSetup):
+    def setUp(self):
+        super(CompareMultiTestCase, self).setUp()
+        self.identical_tree_object = {'identical_root': copy.deepcopy(self.tree_object['root'])}
+        self.identical_tree = treewalk.MemoryTree('/identical_root', self.identical_tree_object)
+
+    def tearDown(self):
+        self.identical_tree_object = None
+        self.identical_tree = None
+        super(CompareMultiTestCase, self).tearDown()
+
+    def check_compare_multi(self, executor=None):
+        patches = [treewalk.PatchContext(), treewalk.PatchContext()]
+        treewalk.deep_compare_multi(self.tree, [self.other_tree, self.identical_tree], patches,
+                                    executor=executor)
+        self.assertEqualPatch(patches[0], self.patch_context)
+        self.assertEqualPatch(patches[1], treewalk.PatchContext())
+
+    def test_compare_multi(self):
+        self.check_compare_multi()
+
+    def test_compare_multi_executor(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            self.check_compare_multi(executor=executor)
+
+    def test_compare_multi_filters(self):
+        mirror_trees = [self.other_tree, self.identical_tree]
+        leaf_filter = lambda x: len(x) > 30
+        node_filter = lambda x: os.path.basename(x) != 'B'
+        patches = [treewalk.PatchContext(), treewalk.PatchContext()]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            treewalk.deep_compare_multi(self.tree, mirror_trees, patches,
+                                        leaf_filter=leaf_filter, node_filter=node_filter,
+                                        executor=executor)
+        for mirror_tree, patch in zip(mirror_trees, patches):
+            expected_patch = treewalk.PatchContext()
+            treewalk.deep_compare(self.tree, mirror_tree, expected_patch,
+                                  leaf_filter=leaf_filter, node_filter=node_filter)
+            self.assertEqualPatch(patch, expected_patch)
+
+    def test_compare_multi_source_calls(self):
+        source_tree = CountingMemoryTree('/root', self.tree_object)
+        treewalk.deep_compare_multi(source_tree, [self.other_tree], [treewalk.PatchContext()])
+        single_call_count = source_tree.call_count
+
+        source_tree = CountingMemoryTree('/root', self.tree_object)
+        mirror_trees = [self.other_tree, self.identical_tree] * 4
+        treewalk.deep_compare_multi(source_tree, mirror_trees,
+                                    [treewalk.PatchContext() for _ in mirror_trees])
+        self.assertEqual(source_tree.call_count, single_call_count)
+
+    def test_compare_multi_failing_mirror(self):
+        modif_ref = next(iter(self.patch_context.modif_leafs))
+        failing_ref = self.other_tree.get_abs_ref(self.tree.get_relative_ref(modif_ref))
+        failing_tree = FailingMemoryTree('/other_root', self.other_tree_object, failing_ref)
+        patches = [treewalk.PatchContext(), treewalk.PatchContext()]
+        treewalk.deep_compare_multi(self.tree, [failing_tree, self.identical_tree], patches)
+        expected_patch = treewalk.PatchContext()
+        treewalk.deep_compare(self.tree, failing_tree, expected_patch)
+        self.assertEqualPatch(patches[0], expected_patch)
+        self.assertEqual(len(patches[0].modif_leafs), len(self.patch_context.modif_leafs) - 1)
+        self.assertEqualPatch(patches[1], treewalk.PatchContext())
+
+    def test_compare_multi_patch_count(self):
+        with self.assertRaises(ValueError):
+            treewalk.deep_compare_multi(self.tree, [self.other_tree, self.identical_tree],
+                                        [treewalk.PatchContext()])
+
+
+class FileSystemTreeSetup(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.tree = treewalk.FileSystemTree(self.temp_dir)
+        self.leaf_count = random_tree(
+            self.tree,
+            lambda tree, node_ref, node_data: tree.write(node_ref, node_data),
+            count=50, variance=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        self.tree = None
+
+
+class FileSystemTreeTestCase(FileSystemTreeSetup):
+    def test_stat_record(self):
+        leaf_count, _ = treewalk.count_nodes(self.tree)
+        self.assertEqual(leaf_count, self.leaf_count)
+
+        node_data = self.tree.get_node_data(self.temp_dir)
+        self.assertEqual(node_data._fields, treewalk.DEFAULT_STAT_FIELDS)
+        self.assertEqual(node_data.st_mtime_ns, os.stat(self.temp_dir).st_mtime_ns)
+        self.assertEqual(hash(node_data), hash(self.tree.get_node_data(self.temp_dir)))
+
+        size_tree = treewalk.FileSystemTree(self.temp_dir, stat_fields=('st_size',))
+        self.assertEqual(size_tree.get_node_data(self.temp_dir)._fields, ('st_mode', 'st_size'))
+        raw_tree = treewalk.FileSystemTree(self.temp_dir, stat_fields=None)
+        self.assertIsInstance(raw_tree.get_node_data(self.temp_dir), os.stat_result)
+
+    def test_stat_fields_order(self):
+        reordered_tree = treewalk.FileSystemTree(
+            self.temp_dir, stat_fields=('st_size', 'st_mtime_ns', 'st_mode'))
+        self.assertEqual(reordered_tree.get_node_data(self.temp_dir),
+                         self.tree.get_node_data(self.temp_dir))
+
+    def test_stat_fields_unknown(self):
+        with self.assertRaises(ValueError):
+            treewalk.FileSystemTree(self.temp_dir, stat_fields=('size',))
+        with self.assertRaises(ValueError):
+            treewalk.FileSystemTree(self.temp_dir, stat_fields=('count',))
+        with self.assertRaises(ValueError):
+            treewalk.FileSystemTree(self.temp_dir, stat_fields='st_size')
+
+    def test_pickle(self):
+        empty_dir = tempfile.mkdtemp()
+        patch = treewalk.PatchContext()
+        treewalk.deep_compare(self.tree, treewalk.FileSystemTree(empty_dir), patch)
+        os.rmdir(empty_dir)
+        self.assertEqual(len(patch.insert_leafs), self.leaf_count)
+        self.assertEqual(pickle.loads(pickle.dumps(patch.insert_leafs)), patch.insert_leafs)
+
+        custom_tree = treewalk.FileSystemTree(self.temp_dir, stat_fields=('st_size', 'st_uid'))
+        node_data = custom_tree.get_node_data(self.temp_dir)
+        loaded_node_data = pickle.loads(pickle.dumps(node_data))
+        self.assertEqual(loaded_node_data, node_data)
+        self.assertEqual(loaded_node_data._fields, ('st_mode', 'st_size', 'st_uid'))
+
+
+class FileSystemCompareTestCase(FileSystemTreeSetup):
+    def setUp(self):
+        super(FileSystemCompareTestCase, self).setUp()
+        self.leaf_ref = os.path.join(self.temp_dir, random_path())
+        self.tree.write(self.leaf_ref, 1)
+        self.mirror_dir = os.path.join(tempfile.mkdtemp(), 'mirror')
+        shutil.copytree(self.temp_dir, self.mirror_dir)
+        self.mirror_tree = treewalk.FileSystemTree(self.mirror_dir)
+        self.mirror_leaf_ref = os.path.join(self.mirror_dir, os.path.relpath(self.leaf_ref, self.temp_dir))
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.mirror_dir), ignore_errors=True)
+        self.mirror_tree = None
+        super(FileSystemCompareTestCase, self).tearDown()
+
+    def compare(self):
+        patch = treewalk.PatchContext()
+        treewalk.deep_compare(self.tree, self.mirror_tree, patch)
+        self.assertEqual(patch.insert_leafs, {})
+        self.assertEqual(patch.delete_leafs, {})
+        return patch
+
+    def test_compare_copy(self):
+        self.assertEqual(self.compare().modif_leafs, {})
+
+    def test_compare_modified(self):
+        mirror_stat = os.stat(self.mirror_leaf_ref)
+        self.mirror_tree.write(self.mirror_leaf_ref, 1000)
+        os.utime(self.mirror_leaf_ref, ns=(mirror_stat.st_atime_ns, mirror_stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(list(self.compare().modif_leafs), [self.leaf_ref])
+
+    def test_compare_multi(self):
+        second_mirror_dir = os.path.join(os.path.dirname(self.mirror_dir), 'second_mirror')
+        shutil.copytree(self.mirror_dir, second_mirror_dir)
+        second_mirror_tree = treewalk.FileSystemTree(second_mirror_dir)
+        self.mirror_tree.write(self.mirror_leaf_ref, 1000)
+        self.mirror_tree.write(os.path.join(self.mirror_dir, 'deleted_leaf'), 1)
+        os.remove(os.path.join(second_mirror_dir, os.path.relpath(self.leaf_ref, self.temp_dir)))
+
+        mirror_trees = [self.mirror_tree, second_mirror_tree]
+        patches = [treewalk.PatchContext(), treewalk.PatchContext()]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            treewalk.deep_compare_multi(self.tree, mirror_trees, patches, executor=executor)
+        for mirror_tree, patch in zip(mirror_trees, patches):
+            expected_patch = treewalk.PatchContext()
+            treewalk.deep_compare(self.tree, mirror_tree, expected_patch)
+            self.assertEqual(patch.insert_leafs, expected_patch.insert_leafs)
+            self.assertEqual(patch.modif_leafs, expected_patch.modif_leafs)
+            self.assertEqual(patch.delete_leafs, expected_patch.delete_leafs)
+            self.assertEqual(patch.delete_nodes, expected_patch.delete_nodes)
+        self.assertEqual(list(patches[0].modif_leafs), [self.leaf_ref])
+        self.assertEqual(list(patches[0].delete_leafs), [os.path.join(self.temp_dir, 'deleted_leaf')])
+        self.assertEqual(list(patches[1].insert_leafs), [self.leaf_ref])
+
+    def test_compare_atime_only(self):
+        mirror_stat = os.stat(self.mirror_leaf_ref)
+        os.utime(self.mirror_leaf_ref, ns=(mirror_stat.st_atime_ns + 10 ** 9, mirror_stat.st_mtime_ns))
+        self.assertEqual(self.compare().modif_leafs, {})
+
+
 test_cases = (CountReflectTestCase, CompareTestCase,
               CompareWithModificationsTestCase, CompareInplaceTestCase,
-              PatchTreeTestCase)
+              PatchTreeTestCase, CompareMultiTestCase,
+              FileSystemTreeTestCase, FileSystemCompareTestCase)
 
 
 def load_tests(loader, std_tests, pattern):
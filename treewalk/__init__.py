@@ -1,2 +1,2 @@
-from .treewalk import count_nodes, patch_tree, deep_compare, reflect_tree,\
-    MemoryTree, FileSystemTree, PatchContext, MirrorTreeContext
+from .treewalk import count_nodes, patch_tree, deep_compare, deep_compare_multi, reflect_tree,\
+    MemoryTree, FileSystemTree, PatchContext, MirrorTreeContext, DEFAULT_STAT_FIELDS
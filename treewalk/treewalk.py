@@ -3,6 +3,7 @@ import os
 import stat
 import shutil
 import json
+from collections import namedtuple
 
 
 def get_logger():
@@ -44,16 +45,62 @@ class BaseTree(object):
         pass
 
 
+# os.stat_result fields kept by FileSystemTree by default. st_atime is left out on
+# purpose, reading a file changes it and it would show up as a modification.
+# fields are kept sorted so records of trees with the same fields compare equal
+DEFAULT_STAT_FIELDS = ('st_mode', 'st_mtime_ns', 'st_size')
+StatRecord = namedtuple('StatRecord', DEFAULT_STAT_FIELDS)
+stat_records = {DEFAULT_STAT_FIELDS: StatRecord}
+
+
+def load_stat_record(fields, values):
+    return make_stat_record(fields)._make(values)
+
+
+def reduce_stat_record(record):
+    # custom records are not module attributes, pickle them by their fields instead
+    return load_stat_record, (record._fields, tuple(record))
+
+
+def make_stat_record(stat_fields):
+    if isinstance(stat_fields, str):
+        raise ValueError(u'stat_fields must be a sequence of field names, got {!r}'.format(stat_fields))
+    # st_mode is always kept since is_leaf needs it
+    fields = tuple(sorted(set(stat_fields) | {'st_mode'}))
+    if fields not in stat_records:
+        for field in fields:
+            if not (field.startswith('st_') and hasattr(os.stat_result, field)):
+                raise ValueError(u'unknown os.stat_result field {}'.format(field))
+        record = namedtuple('StatRecord', fields)
+        record.__reduce__ = reduce_stat_record
+        stat_records[fields] = record
+    return stat_records[fields]
+
+
+def warn_stat_fields_mismatch(tree_a, tree_b):
+    # records compare by position, trees projecting different fields never match
+    stat_record_a = getattr(tree_a, 'stat_record', None)
+    stat_record_b = getattr(tree_b, 'stat_record', None)
+    if stat_record_a is not None and stat_record_b is not None and stat_record_a is not stat_record_b:
+        get_logger().warning(u'comparing trees with different stat fields {} and {}'.format(
+            stat_record_a._fields, stat_record_b._fields))
+
+
 class FileSystemTree(BaseTree):
-    def __init__(self, root, is_mirror=False):
+    # stat_fields=None keeps the raw os.stat_result as node data
+    def __init__(self, root, is_mirror=False, stat_fields=DEFAULT_STAT_FIELDS):
         super().__init__(root)
         self.is_mirror = is_mirror
+        self.stat_record = None if stat_fields is None else make_stat_record(stat_fields)
 
     def is_exist(self, node_ref):
         return os.path.exists(node_ref)
 
     def get_node_data(self, node_ref):
-        return os.stat(node_ref)
+        stat_result = os.stat(node_ref)
+        if self.stat_record is None:
+            return stat_result
+        return self.stat_record._make(getattr(stat_result, x) for x in self.stat_record._fields)
 
     def is_leaf(self, node_data):
         mode = node_data.st_mode
@@ -142,6 +189,23 @@ class MemoryTree(BaseTree):
         node.pop(tail)
 
 
+class SnapshotTree(BaseTree):
+    # answers is_exist from the relative refs recorded in a single walk of tree
+    def __init__(self, tree, rel_refs):
+        super().__init__(tree.root)
+        self.tree = tree
+        self.rel_refs = rel_refs
+
+    def is_exist(self, node_ref):
+        return self.get_relative_ref(node_ref) in self.rel_refs
+
+    def get_relative_ref(self, node_ref):
+        return self.tree.get_relative_ref(node_ref)
+
+    def get_abs_ref(self, node_ref):
+        return self.tree.get_abs_ref(node_ref)
+
+
 class BaseContext(object):
     def node(self, node_ref, node_data):
         pass
@@ -245,6 +309,27 @@ class ModifContext(MirrorTreeContext):
                 self.sub_context.leaf(node_ref, node_data)
 
 
+class SourceListContext(BaseContext):
+    def __init__(self, tree, leafs, rel_refs,
+                 node_filter=lambda x: True, leaf_filter=lambda x: True):
+        self.tree = tree
+        self.leafs = leafs
+        self.rel_refs = rel_refs
+        self.node_filter = node_filter
+        self.source_leaf_filter = leaf_filter
+
+    def node(self, node_ref, node_data):
+        self.rel_refs.add(self.tree.get_relative_ref(node_ref))
+
+    def leaf(self, node_ref, node_data):
+        # the relative ref is computed once and shared by all mirrors. every leaf is
+        # recorded as existing, the delete pass of deep_compare ignores leaf_filter too
+        rel_ref = self.tree.get_relative_ref(node_ref)
+        self.rel_refs.add(rel_ref)
+        if self.source_leaf_filter(node_ref):
+            self.leafs.append((node_ref, rel_ref, node_data))
+
+
 class ComposeContext(BaseContext):
     def __init__(self, sub_context_a, sub_context_b):
         self.sub_context_a = sub_context_a
@@ -371,6 +456,8 @@ def deleted_node_handler(node_ref, diff_context, context, sub_filter):
 def deep_compare(tree_a, tree_b, patch_context,
                  leaf_compare=lambda x, y: x == y,
                  leaf_filter=lambda x: True, node_filter=lambda x: True):
+    warn_stat_fields_mismatch(tree_a, tree_b)
+
     # 1st pass: find inserts / modifs
     diff_insert_context = DiffContext(tree_a, tree_b, patch_context.insert_context)
     modif_context = ModifContext(tree_a, tree_b, patch_context.modif_context,
@@ -380,6 +467,10 @@ def deep_compare(tree_a, tree_b, patch_context,
     tree_walk(tree_a, tree_a.root, filter_context)
 
     # 2nd pass: find deletes
+    compare_deletes(tree_a, tree_b, patch_context, node_filter=node_filter)
+
+
+def compare_deletes(tree_a, tree_b, patch_context, node_filter=lambda x: True):
     diff_context = DiffContext(tree_b, tree_a, patch_context.delete_context, is_reflected=True)
     filter_context = FilterContext(
         diff_context,
@@ -387,6 +478,54 @@ def deep_compare(tree_a, tree_b, patch_context,
     tree_walk(tree_b, tree_b.root, filter_context)
 
 
+def compare_leafs(leafs, tree_b, patch_context, leaf_compare=lambda x, y: x == y):
+    for node_ref, rel_ref, node_data in leafs:
+        reflect_ref = tree_b.get_abs_ref(rel_ref)
+        try:
+            if not tree_b.is_exist(reflect_ref):
+                patch_context.insert_context.leaf(node_ref, node_data)
+            elif not leaf_compare(node_data, tree_b.get_node_data(reflect_ref)):
+                patch_context.modif_context.leaf(node_ref, node_data)
+        except IOError:
+            get_logger().warning(u'failed to scan {}'.format(reflect_ref), exc_info=True)
+
+
+def compare_mirror(snapshot_tree, leafs, tree_b, patch_context,
+                   leaf_compare=lambda x, y: x == y, node_filter=lambda x: True):
+    warn_stat_fields_mismatch(snapshot_tree.tree, tree_b)
+    compare_leafs(leafs, tree_b, patch_context, leaf_compare=leaf_compare)
+    compare_deletes(snapshot_tree, tree_b, patch_context, node_filter=node_filter)
+
+
+def deep_compare_multi(tree_a, mirror_trees, patch_contexts,
+                       leaf_compare=lambda x, y: x == y,
+                       leaf_filter=lambda x: True, node_filter=lambda x: True,
+                       executor=None):
+    # patch_contexts[i] gets the same result as deep_compare(tree_a, mirror_trees[i], ...)
+    # but tree_a is walked only once. an optional executor (e.g. ThreadPoolExecutor)
+    # compares each mirror in a single task of its own.
+    if len(mirror_trees) != len(patch_contexts):
+        raise ValueError(u'expected one patch context per mirror tree')
+
+    # 1st pass: collect the leafs and existing refs of tree_a once for all mirrors
+    leafs = []
+    rel_refs = set()
+    tree_walk(tree_a, tree_a.root, SourceListContext(tree_a, leafs, rel_refs,
+                                                     node_filter=node_filter, leaf_filter=leaf_filter))
+    snapshot_tree = SnapshotTree(tree_a, frozenset(rel_refs))
+
+    # 2nd pass: find inserts / modifs / deletes, each mirror independently
+    if executor is None:
+        for tree_b, patch_context in zip(mirror_trees, patch_contexts):
+            compare_mirror(snapshot_tree, leafs, tree_b, patch_context, leaf_compare, node_filter)
+    else:
+        futures = [executor.submit(compare_mirror, snapshot_tree, leafs, tree_b, patch_context,
+                                   leaf_compare, node_filter)
+                   for tree_b, patch_context in zip(mirror_trees, patch_contexts)]
+        for future in futures:
+            future.result()
+
+
 def patch_tree(tree, patch_context, callback=lambda x, y: (x, y)):
     for leaf_ref in patch_context.insert_leafs:
         process_ref, process_data = callback(leaf_ref, patch_context.insert_leafs[leaf_ref])